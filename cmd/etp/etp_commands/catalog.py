@@ -2,19 +2,27 @@
 
 Orchestrates etp-scan, etp-tree, and etp-csv across multiple directory trees,
 generating tree files and CSV metadata indexes. Runs etp-scan first, then
-etp-tree and etp-csv in parallel for each scan entry.
+etp-tree and etp-csv in parallel for each scan entry. With --jobs, scans on
+different devices also run concurrently.
 """
 
 import argparse
 import concurrent.futures
+import copy
+import functools
 import os
 import re
+import shlex
+import shutil
 import subprocess
 import sys
+import threading
 import time
+from collections import defaultdict
 from collections.abc import Sequence
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Self
+from typing import IO, Any, Self
 
 
 # ---------------------------------------------------------------------------
@@ -22,28 +30,64 @@ from typing import Any, Self
 # ---------------------------------------------------------------------------
 
 
+_INTERP_RE = re.compile(r"\{(\w+)\}")
+
+
 def resolve_global(global_cfg: dict[str, str]) -> dict[str, str]:
     """Expand env vars and resolve {key} interpolation in global paths.
 
-    Keys are processed in definition order so that later values can
-    reference earlier ones (e.g. trees_path references home_base).
+    References may point at keys defined anywhere in the file. A {key} is
+    only replaced once its target resolves completely, so cyclic references
+    stay literal instead of expanding into each other. Any {key} that can't
+    be resolved is left as-is with a warning.
     """
+    if not any("$" in v or "{" in v for v in global_cfg.values()):
+        return dict(global_cfg)
+
+    # First expand $ENV_VAR / ${ENV_VAR}
+    expanded = {
+        key: os.path.expandvars(value) if "$" in value else value
+        for key, value in global_cfg.items()
+    }
+
+    # Then resolve {other_key} references, depth-first with cycle detection
     resolved: dict[str, str] = {}
-    for key, value in global_cfg.items():
-        # First expand $ENV_VAR / ${ENV_VAR}
-        value = os.path.expandvars(value)
-        # Then resolve {other_key} references to already-resolved values
-        value = re.sub(
-            r"\{(\w+)\}",
-            lambda m: resolved.get(m.group(1), m.group(0)),
-            value,
-        )
+
+    def pending(value: str) -> bool:
+        return any(ref in expanded for ref in _INTERP_RE.findall(value))
+
+    def resolve(key: str, visiting: set[str]) -> str:
+        if key in resolved:
+            return resolved[key]
+        visiting.add(key)
+
+        def lookup(m: re.Match[str]) -> str:
+            ref = m.group(1)
+            if ref not in expanded or ref in visiting:
+                return m.group(0)
+            target = resolve(ref, visiting)
+            return m.group(0) if pending(target) else target
+
+        value = expanded[key]
+        if "{" in value:
+            value = _INTERP_RE.sub(lookup, value)
+        visiting.discard(key)
         resolved[key] = value
-    return resolved
+        return value
 
+    result = {key: resolve(key, set()) for key in expanded}
 
-def load_config(path: Path) -> dict[str, Any]:
-    """Load and resolve a catalog KDL config file."""
+    for key, value in result.items():
+        for ref in dict.fromkeys(_INTERP_RE.findall(value)):
+            print(
+                f"warning: global '{key}' has unresolved reference '{{{ref}}}'",
+                file=sys.stderr,
+            )
+    return result
+
+
+def _parse_config(path: Path) -> tuple[dict[str, str], dict[str, dict[str, Any]]]:
+    """Parse a catalog KDL file into raw global values and scan configs."""
     import kdl
 
     text = path.read_text(encoding="utf-8")
@@ -68,6 +112,32 @@ def load_config(path: Path) -> dict[str, Any]:
                     scan_cfg[key] = str(child.args[0])
             scans[name] = scan_cfg
 
+    return raw_global, scans
+
+
+@functools.lru_cache(maxsize=32)
+def _parse_config_cached(
+    path: str, _mtime_ns: int, _size: int
+) -> tuple[dict[str, str], dict[str, dict[str, Any]]]:
+    """Parse a config file, memoized on its path, mtime and size."""
+    return _parse_config(Path(path))
+
+
+def load_config(path: Path) -> dict[str, Any]:
+    """Load and resolve a catalog KDL config file.
+
+    Parsing is cached until the file's mtime or size changes. Interpolation
+    runs on every call, so environment changes are always picked up.
+    """
+    try:
+        st = path.stat()
+    except OSError:
+        raw_global, scans = _parse_config(path)
+    else:
+        raw_global, scans = copy.deepcopy(
+            _parse_config_cached(str(path.absolute()), st.st_mtime_ns, st.st_size)
+        )
+
     cfg: dict[str, Any] = {}
     cfg["global"] = resolve_global(raw_global)
     cfg["scans"] = scans
@@ -79,27 +149,49 @@ def load_config(path: Path) -> dict[str, Any]:
 # ---------------------------------------------------------------------------
 
 
-class Timer:
-    """Context manager that captures wall-clock and child-process CPU time."""
+class WallTimer:
+    """Context manager that captures wall-clock time only."""
+
+    __slots__ = ("_start", "elapsed")
 
     def __enter__(self) -> Self:
-        self.wall = time.monotonic()
-        self.times = os.times()
+        self._start = time.monotonic_ns()
         self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *_exc: Any) -> bool:
+        self.elapsed = (time.monotonic_ns() - self._start) / 1e9
+        return False
+
+    def __str__(self) -> str:
+        return f"real {self.elapsed:.1f}s"
+
+
+class Timer(WallTimer):
+    """Context manager that captures wall-clock and child-process CPU time.
+
+    Child CPU time is process-wide, so it is only meaningful when nothing
+    else is running subprocesses concurrently.
+    """
+
+    __slots__ = ("_times", "user", "sys")
+
+    def __enter__(self) -> Self:
+        super().__enter__()
+        self._times = os.times()
         self.user = 0.0
         self.sys = 0.0
         return self
 
     def __exit__(self, *_exc: Any) -> bool:
-        wall_end = time.monotonic()
+        super().__exit__()
         times_end = os.times()
-        self.elapsed = wall_end - self.wall
-        self.user = times_end.children_user - self.times.children_user
-        self.sys = times_end.children_system - self.times.children_system
+        self.user = times_end.children_user - self._times.children_user
+        self.sys = times_end.children_system - self._times.children_system
         return False
 
     def __str__(self) -> str:
-        return f"real {self.elapsed:.1f}s  user {self.user:.1f}s  sys {self.sys:.1f}s"
+        return f"{super().__str__()}  user {self.user:.1f}s  sys {self.sys:.1f}s"
 
 
 # ---------------------------------------------------------------------------
@@ -111,26 +203,34 @@ def run_cmd(
     args: Sequence[str],
     *,
     capture: bool = False,
+    stdout: IO[bytes] | None = None,
     env_extra: dict[str, str] | None = None,
     verbose: bool = False,
-) -> str | None:
-    """Run a command, optionally capturing stdout.
+) -> bytes | None:
+    """Run a command, optionally capturing stdout or sending it to a file.
 
-    Returns captured stdout when capture=True, otherwise None.
+    Returns captured stdout as raw bytes when capture=True, otherwise None.
+    When stdout is given, the child writes directly to that file's
+    descriptor.
     """
-    env = os.environ.copy()
-    if env_extra:
-        env.update(env_extra)
+    # Children inherit our environment as-is unless extra vars are requested
+    env = {**os.environ, **env_extra} if env_extra else None
 
     if verbose:
-        print(f"  $ {' '.join(args)}", flush=True)
+        # Flush so the banner lands before the child's output on shared stdout
+        print(f"  $ {shlex.join(args)}", flush=True)
 
     result = subprocess.run(
         args,
         check=True,
-        capture_output=capture,
-        text=capture,
+        stdout=subprocess.PIPE if capture else stdout,
+        stderr=subprocess.PIPE if capture else None,
         env=env,
+        # Every descriptor Python opens is non-inheritable (PEP 446), so the
+        # child has nothing of ours to close. Skipping the close-all sweep
+        # also keeps CPython on its posix_spawn fast path on platforms whose
+        # libc has no closefrom file action (macOS, older glibc).
+        close_fds=False,
     )
     if capture:
         return result.stdout
@@ -159,7 +259,47 @@ def require_binary(name: str) -> str:
 # ---------------------------------------------------------------------------
 
 
-VALID_MODES = {"used", "df", "subs"}
+@dataclass(frozen=True, slots=True)
+class CatalogPaths:
+    """Output directories and binaries, resolved once per run."""
+
+    trees: Path
+    csvs: Path
+    db: Path
+    etp_scan: str
+    etp_tree: str
+    etp_csv: str
+    df: str
+
+    @classmethod
+    def resolve(cls, global_cfg: dict[str, str]) -> Self:
+        """Build from resolved global config; exits if a binary is missing."""
+        return cls(
+            trees=Path(global_cfg["trees_path"]),
+            csvs=Path(global_cfg["csvs_path"]),
+            db=Path(global_cfg["db_path"]),
+            etp_scan=require_binary("etp-scan"),
+            etp_tree=require_binary("etp-tree"),
+            etp_csv=require_binary("etp-csv"),
+            # An absolute path lets subprocess use posix_spawn for df too
+            df=shutil.which("df") or "df",
+        )
+
+
+@dataclass(frozen=True, slots=True)
+class ScanMode:
+    """What a scan mode adds to its tree file."""
+
+    tree_flags: tuple[str, ...]  # extra etp-tree flags (size summaries)
+    df: bool  # append `df -PH` output after the tree
+
+
+SCAN_MODES: dict[str, ScanMode] = {
+    "used": ScanMode(tree_flags=("--du",), df=False),
+    "df": ScanMode(tree_flags=(), df=True),
+    "subs": ScanMode(tree_flags=("--du", "--du-subs"), df=True),
+}
+VALID_MODES = frozenset(SCAN_MODES)
 REQUIRED_SCAN_FIELDS = ("disk", "header", "mode", "desc")
 
 
@@ -177,7 +317,7 @@ def _validate_scan_cfg(name: str, scan_cfg: dict[str, Any]) -> None:
 def generate_tree(
     name: str,
     scan_cfg: dict[str, Any],
-    global_cfg: dict[str, str],
+    paths: CatalogPaths,
     *,
     verbose: bool = False,
     profile: bool = False,
@@ -188,34 +328,39 @@ def generate_tree(
     mode = scan_cfg["mode"]
     desc = scan_cfg["desc"]
 
-    etp_tree = require_binary("etp-tree")
-    tree_file = Path(global_cfg["trees_path"]) / f"{desc}.tree"
-    db_file = Path(global_cfg["db_path"]) / f"{desc}.db"
+    tree_file = paths.trees / f"{desc}.tree"
+    db_file = paths.db / f"{desc}.db"
+
+    try:
+        spec = SCAN_MODES[mode]
+    except KeyError:
+        raise ValueError(f"unknown mode '{mode}'") from None
 
-    cmd: list[str] = [etp_tree, disk, "--db", str(db_file), "-N"]
-    if mode in ("used", "subs"):
-        cmd.append("--du")
-    if mode == "subs":
-        cmd.append("--du-subs")
+    cmd: list[str] = [paths.etp_tree, disk, "--db", str(db_file), "-N"]
+    cmd.extend(spec.tree_flags)
     if verbose:
         cmd.append("-v")
     if profile:
         cmd.append("--profile")
 
-    tree_out = run_cmd(cmd, capture=True, verbose=verbose) or ""
-
-    suffix_parts: list[str] = []
-    if mode in ("df", "subs"):
-        suffix_parts.append(
-            run_cmd(["df", "-PH", disk], capture=True, verbose=verbose) or ""
-        )
-
-    with open(tree_file, "w", encoding="utf-8") as f:
-        f.write(header + "\n\n")
-        f.write(tree_out)
-        for part in suffix_parts:
-            f.write("\n")
-            f.write(part)
+    suffix_cmds: list[list[str]] = []
+    if spec.df:
+        suffix_cmds.append([paths.df, "-PH", disk])
+
+    # Stream each command's output straight into the tree file. Writes go to
+    # a sibling temp file so a failed command leaves the previous tree alone.
+    tmp_file = tree_file.with_name(tree_file.name + ".tmp")
+    try:
+        with open(tmp_file, "wb", buffering=0) as f:
+            f.write(header.encode("utf-8") + b"\n\n")
+            run_cmd(cmd, stdout=f, verbose=verbose)
+            for suffix_cmd in suffix_cmds:
+                f.write(b"\n")
+                run_cmd(suffix_cmd, stdout=f, verbose=verbose)
+        tmp_file.replace(tree_file)
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
 
     return str(tree_file)
 
@@ -223,7 +368,7 @@ def generate_tree(
 def generate_csv(
     name: str,
     scan_cfg: dict[str, Any],
-    global_cfg: dict[str, str],
+    paths: CatalogPaths,
     *,
     verbose: bool = False,
     profile: bool = False,
@@ -232,11 +377,10 @@ def generate_csv(
     disk = scan_cfg["disk"]
     desc = scan_cfg["desc"]
 
-    etp_csv = require_binary("etp-csv")
-    csv_file = Path(global_cfg["csvs_path"]) / f"{desc}.csv"
-    db_file = Path(global_cfg["db_path"]) / f"{desc}.db"
+    csv_file = paths.csvs / f"{desc}.csv"
+    db_file = paths.db / f"{desc}.db"
 
-    cmd = [etp_csv, disk, "--db", str(db_file), "-o", str(csv_file)]
+    cmd = [paths.etp_csv, disk, "--db", str(db_file), "-o", str(csv_file)]
     if verbose:
         cmd.append("-v")
     if profile:
@@ -249,11 +393,17 @@ def generate_csv(
 def run_scan(
     name: str,
     scan_cfg: dict[str, Any],
-    global_cfg: dict[str, str],
+    paths: CatalogPaths,
     *,
     verbose: bool = False,
     profile: bool = False,
+    cpu_times: bool = True,
 ) -> bool:
+    """Scan one entry, then generate its tree and CSV. Returns success.
+
+    Pass cpu_times=False when other scans run concurrently: child CPU time
+    can't be attributed to a single scan, so only wall time is reported.
+    """
     _validate_scan_cfg(name, scan_cfg)
     disk = scan_cfg["disk"]
     desc = scan_cfg["desc"]
@@ -267,21 +417,22 @@ def run_scan(
         print(f"error: unknown mode '{mode}' for scan '{name}'", file=sys.stderr)
         return False
 
-    etp_scan = require_binary("etp-scan")
-    db_file = Path(global_cfg["db_path"]) / f"{desc}.db"
+    db_file = paths.db / f"{desc}.db"
 
     print(f"\n# cataloging {name}: {disk}", flush=True)
 
+    timer = Timer if cpu_times else WallTimer
+
     ok = True
-    with Timer() as total:
+    with timer() as total:
         # Phase 1: scan the directory
-        scan_cmd: list[str] = [etp_scan, disk, "--db", str(db_file)]
+        scan_cmd: list[str] = [paths.etp_scan, disk, "--db", str(db_file)]
         if verbose:
             scan_cmd.append("-v")
         if profile:
             scan_cmd.append("--profile")
 
-        with Timer() as scan_t:
+        with timer() as scan_t:
             try:
                 run_cmd(scan_cmd, verbose=verbose)
             except subprocess.CalledProcessError as exc:
@@ -290,17 +441,17 @@ def run_scan(
                     file=sys.stderr,
                 )
                 return False
-        print(f"# scan: {scan_t}", flush=True)
+        print(f"# {name} scan: {scan_t}", flush=True)
 
         # Phase 2: generate tree and CSV in parallel (both read from existing DB)
-        with Timer() as output_t:
+        with timer() as output_t:
             try:
                 with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
                     tree_future = pool.submit(
                         generate_tree,
                         name,
                         scan_cfg,
-                        global_cfg,
+                        paths,
                         verbose=verbose,
                         profile=profile,
                     )
@@ -308,7 +459,7 @@ def run_scan(
                         generate_csv,
                         name,
                         scan_cfg,
-                        global_cfg,
+                        paths,
                         verbose=verbose,
                         profile=profile,
                     )
@@ -320,17 +471,96 @@ def run_scan(
                     file=sys.stderr,
                 )
                 ok = False
-        print(f"# tree+csv: {output_t}", flush=True)
+        print(f"# {name} tree+csv: {output_t}", flush=True)
 
     print(f"# {name} TOTAL: {total}", flush=True)
     return ok
 
 
+def _worker_count() -> int:
+    """Number of CPUs this process may run on, honoring affinity masks."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def device_lanes(
+    scans: dict[str, dict[str, Any]],
+) -> list[list[tuple[str, dict[str, Any]]]]:
+    """Group scans into lanes by the device their disk lives on.
+
+    Scans sharing a device land in the same lane so they run one after
+    another instead of contending for the same spindle. Scans whose disk
+    can't be stat'd get a lane of their own (run_scan reports the problem).
+    Lanes and the scans within them keep config order.
+    """
+    lanes: defaultdict[object, list[tuple[str, dict[str, Any]]]] = defaultdict(list)
+    for name, scan_cfg in scans.items():
+        key: object
+        try:
+            key = os.stat(scan_cfg.get("disk", "")).st_dev
+        except OSError:
+            key = ("unknown", name)
+        lanes[key].append((name, scan_cfg))
+    return list(lanes.values())
+
+
+def _run_lane(
+    lane: list[tuple[str, dict[str, Any]]],
+    paths: CatalogPaths,
+    *,
+    verbose: bool = False,
+    profile: bool = False,
+    cpu_times: bool = True,
+    stop: threading.Event | None = None,
+) -> list[str]:
+    """Run a lane of scans sequentially. Returns the names of failed scans.
+
+    When stop is set (e.g. on Ctrl-C), no further scans in the lane start.
+    """
+    failed: list[str] = []
+    for name, scan_cfg in lane:
+        if stop is not None and stop.is_set():
+            break
+        try:
+            ok = run_scan(
+                name,
+                scan_cfg,
+                paths,
+                verbose=verbose,
+                profile=profile,
+                cpu_times=cpu_times,
+            )
+            if not ok:
+                failed.append(name)
+        except subprocess.CalledProcessError as exc:
+            print(
+                f"\nerror: in {name} scan, '{exc.cmd}' failed: {exc}",
+                file=sys.stderr,
+            )
+            failed.append(name)
+        except Exception as exc:
+            print(f"\nerror: scan '{name}': {exc}", file=sys.stderr)
+            failed.append(name)
+    return failed
+
+
 # ---------------------------------------------------------------------------
 # CLI
 # ---------------------------------------------------------------------------
 
 
+def _job_count(value: str) -> int:
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid job count: {value!r}") from None
+    if n < 0:
+        raise argparse.ArgumentTypeError(f"must be 0 or more, got {n}")
+    return n
+
+
 def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         description="Catalog filesystem trees using etp-scan, etp-tree, etp-csv, and df.",
@@ -364,6 +594,16 @@ def build_parser() -> argparse.ArgumentParser:
         action="store_true",
         help="Pass --profile to etp-scan/etp-tree/etp-csv for Chrome Trace output",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=_job_count,
+        default=None,
+        metavar="N",
+        help="Run up to N scans at once; 0 means one per available CPU. Scans "
+        "on the same device always run one at a time (default: "
+        "$ETP_CATALOG_JOBS, else 1)",
+    )
     return parser
 
 
@@ -371,6 +611,15 @@ def main(argv: list[str] | None = None) -> int:
     parser = build_parser()
     args = parser.parse_args(argv)
 
+    if args.jobs is None:
+        env_jobs = os.environ.get("ETP_CATALOG_JOBS")
+        try:
+            args.jobs = _job_count(env_jobs) if env_jobs else 1
+        except argparse.ArgumentTypeError as exc:
+            parser.error(f"ETP_CATALOG_JOBS: {exc}")
+    if args.jobs == 0:
+        args.jobs = _worker_count()
+
     # Resolve config path: explicit arg > XDG/platform config dir
     if args.config is not None:
         config_path = Path(args.config)
@@ -427,34 +676,59 @@ def main(argv: list[str] | None = None) -> int:
         return 0
 
     with Timer() as running_time:
-        # ensure necessary directories exist
-        Path(global_cfg["trees_path"]).mkdir(parents=True, exist_ok=True)
-        Path(global_cfg["csvs_path"]).mkdir(parents=True, exist_ok=True)
-        Path(global_cfg["db_path"]).mkdir(parents=True, exist_ok=True)
+        paths = CatalogPaths.resolve(global_cfg)
 
-        # Run scans
-        failed: list[str] = []
-        for name, scan_cfg in scans.items():
-            try:
-                ok = run_scan(
-                    name,
-                    scan_cfg,
-                    global_cfg,
-                    verbose=args.verbose,
-                    profile=args.profile,
-                )
-                if not ok:
-                    failed.append(name)
-            except subprocess.CalledProcessError as exc:
-                print(
-                    f"\nerror: in {name} scan, '{exc.cmd}' failed: {exc}",
-                    file=sys.stderr,
+        # ensure necessary directories exist
+        paths.trees.mkdir(parents=True, exist_ok=True)
+        paths.csvs.mkdir(parents=True, exist_ok=True)
+        paths.db.mkdir(parents=True, exist_ok=True)
+
+        # Run scans, one worker per device lane
+        if args.jobs > 1:
+            lanes = device_lanes(scans)
+        else:
+            lanes = [list(scans.items())]
+
+        workers = min(args.jobs, len(lanes))
+        failed_names: set[str] = set()
+        if workers == 1:
+            # Run in the main thread so Ctrl-C stops the run immediately
+            for lane in lanes:
+                failed_names.update(
+                    _run_lane(
+                        lane,
+                        paths,
+                        verbose=args.verbose,
+                        profile=args.profile,
+                    )
                 )
-                failed.append(name)
-            except Exception as exc:
-                print(f"\nerror: scan '{name}': {exc}", file=sys.stderr)
-                failed.append(name)
-
+        else:
+            stop = threading.Event()
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = [
+                    pool.submit(
+                        _run_lane,
+                        lane,
+                        paths,
+                        verbose=args.verbose,
+                        profile=args.profile,
+                        cpu_times=False,
+                        stop=stop,
+                    )
+                    for lane in lanes
+                ]
+                for future in concurrent.futures.as_completed(futures):
+                    failed_names.update(future.result())
+            except BaseException:
+                # On Ctrl-C (or any other abort) let in-flight scans wind
+                # down, but start no new ones
+                stop.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+            pool.shutdown()
+
+        failed = [name for name in scans if name in failed_names]
         if failed:
             print(f"\n{len(failed)} scan(s) failed: {', '.join(failed)}")
             return 1
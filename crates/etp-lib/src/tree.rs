@@ -87,12 +87,17 @@ pub async fn render_tree_from_db(
         no_escape,
     };
 
-    let mut out = io::stdout();
+    // Stdout is line-buffered, which costs one write(2) per tree line when
+    // the output is redirected to a file (as etp-catalog does). Buffer the
+    // whole render in large chunks instead and flush before returning so
+    // the caller's summary lines still follow the tree.
+    let mut out = io::BufWriter::with_capacity(1 << 20, io::stdout().lock());
     writeln!(out, "{}", root.display())?;
 
     let mut dir_count = 1;
     let mut file_count = 0;
     render_dir(&ctx, root, "", &mut dir_count, &mut file_count, &mut out)?;
+    out.flush()?;
     Ok((dir_count, file_count))
 }
 
@@ -1,8 +1,15 @@
 """Tests for etp-catalog config loading, resolution, and CLI."""
 
+import os
+import subprocess
 import textwrap
+import threading
+import time
+from pathlib import Path
 from unittest.mock import patch
 
+import pytest
+
 from etp_commands import catalog
 
 
@@ -11,6 +18,12 @@ class TestResolveGlobal:
         result = catalog.resolve_global({"a": "hello", "b": "world"})
         assert result == {"a": "hello", "b": "world"}
 
+    def test_plain_values_return_a_copy(self):
+        global_cfg = {"a": "hello"}
+        result = catalog.resolve_global(global_cfg)
+        result["a"] = "changed"
+        assert global_cfg == {"a": "hello"}
+
     def test_env_var_expansion(self, monkeypatch):
         monkeypatch.setenv("TEST_VAR", "/some/path")
         result = catalog.resolve_global({"dir": "$TEST_VAR/sub"})
@@ -39,9 +52,49 @@ class TestResolveGlobal:
             "c": "/root/mid/leaf",
         }
 
-    def test_unresolvable_key_left_as_is(self):
+    def test_unresolvable_key_left_as_is(self, capsys):
         result = catalog.resolve_global({"x": "{unknown}/path"})
         assert result == {"x": "{unknown}/path"}
+        assert "unresolved reference '{unknown}'" in capsys.readouterr().err
+
+    def test_forward_reference(self, capsys):
+        result = catalog.resolve_global(
+            {
+                "c": "{b}/leaf",
+                "b": "{a}/mid",
+                "a": "/root",
+            }
+        )
+        assert result == {
+            "c": "/root/mid/leaf",
+            "b": "/root/mid",
+            "a": "/root",
+        }
+        assert capsys.readouterr().err == ""
+
+    def test_cyclic_reference_terminates(self, capsys):
+        result = catalog.resolve_global({"a": "{b}", "b": "x{a}"})
+        assert "{" in result["a"]
+        assert "unresolved reference" in capsys.readouterr().err
+
+    def test_multi_reference_cycle_stays_small(self, capsys):
+        result = catalog.resolve_global({"a": "{b}{b}", "b": "{a}"})
+        assert result == {"a": "{b}{b}", "b": "{a}"}
+        err = capsys.readouterr().err
+        assert err.count("global 'a' has unresolved reference '{b}'") == 1
+        assert err.count("global 'b' has unresolved reference '{a}'") == 1
+
+    def test_self_reference_stays_literal(self, capsys):
+        result = catalog.resolve_global({"a": "{a}{a}", "b": "/root"})
+        assert result == {"a": "{a}{a}", "b": "/root"}
+        assert capsys.readouterr().err.count("unresolved reference '{a}'") == 1
+
+    def test_unknown_reference_propagates_through_chain(self, capsys):
+        result = catalog.resolve_global({"y": "{x}/z", "x": "{unknown}/path"})
+        assert result == {"y": "{unknown}/path/z", "x": "{unknown}/path"}
+        err = capsys.readouterr().err
+        assert "global 'y' has unresolved reference '{unknown}'" in err
+        assert "global 'x' has unresolved reference '{unknown}'" in err
 
     def test_env_var_and_interpolation_combined(self, monkeypatch):
         monkeypatch.setenv("HOME", "/home/user")
@@ -131,6 +184,33 @@ class TestLoadConfig:
         assert len(cfg["scans"]) == 1
         assert "active" in cfg["scans"]
 
+    def test_reparses_after_file_changes(self, tmp_path):
+        config = tmp_path / "reload.kdl"
+        config.write_text('global {\n    trees-path "/first"\n}\n')
+        assert catalog.load_config(config)["global"]["trees_path"] == "/first"
+
+        config.write_text('global {\n    trees-path "/second"\n}\n')
+        st = config.stat()
+        os.utime(config, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+        assert catalog.load_config(config)["global"]["trees_path"] == "/second"
+
+    def test_cached_result_not_shared_with_callers(self, tmp_path):
+        config = tmp_path / "shared.kdl"
+        config.write_text('scan "a" {\n    mode "used"\n}\n')
+
+        first = catalog.load_config(config)
+        first["scans"]["a"]["mode"] = "df"
+        assert catalog.load_config(config)["scans"]["a"]["mode"] == "used"
+
+    def test_env_expansion_not_cached(self, tmp_path, monkeypatch):
+        config = tmp_path / "env.kdl"
+        config.write_text('global {\n    base "$CATALOG_TEST_BASE"\n}\n')
+
+        monkeypatch.setenv("CATALOG_TEST_BASE", "/one")
+        assert catalog.load_config(config)["global"]["base"] == "/one"
+        monkeypatch.setenv("CATALOG_TEST_BASE", "/two")
+        assert catalog.load_config(config)["global"]["base"] == "/two"
+
 
 class TestTimer:
     def test_str_format(self):
@@ -148,6 +228,17 @@ class TestTimer:
             time.sleep(0.01)
         assert t.elapsed >= 0.01
 
+    def test_wall_timer_reports_real_only(self):
+        with catalog.WallTimer() as t:
+            pass
+        assert str(t).startswith("real ")
+        assert "user" not in str(t)
+
+    def test_no_instance_dict(self):
+        with catalog.Timer() as t:
+            pass
+        assert not hasattr(t, "__dict__")
+
 
 class TestCLIDryRun:
     def test_dry_run_prints_plan(self, tmp_path, capsys):
@@ -250,41 +341,72 @@ def _make_scan_cfg(mode, disk="/vol/data"):
     }
 
 
-def _make_global_cfg(tmp_path):
+def _make_paths(tmp_path):
     trees = tmp_path / "trees"
     db = tmp_path / "db"
     trees.mkdir()
     db.mkdir()
-    return {
-        "trees_path": str(trees),
-        "db_path": str(db),
-    }
+    return catalog.CatalogPaths(
+        trees=trees,
+        csvs=tmp_path / "csvs",
+        db=db,
+        etp_scan="/usr/bin/etp-scan",
+        etp_tree="/usr/bin/etp-tree",
+        etp_csv="/usr/bin/etp-csv",
+        df="/bin/df",
+    )
+
+
+class TestCatalogPaths:
+    def test_resolve_from_global_cfg(self):
+        global_cfg = {
+            "trees_path": "/data/trees",
+            "csvs_path": "/data/trees/csv",
+            "db_path": "/data/trees/db",
+        }
+        with patch.object(
+            catalog, "require_binary", side_effect=lambda n: f"/opt/bin/{n}"
+        ):
+            paths = catalog.CatalogPaths.resolve(global_cfg)
+
+        assert paths.trees == Path("/data/trees")
+        assert paths.csvs == Path("/data/trees/csv")
+        assert paths.db == Path("/data/trees/db")
+        assert paths.etp_scan == "/opt/bin/etp-scan"
+        assert paths.etp_tree == "/opt/bin/etp-tree"
+        assert paths.etp_csv == "/opt/bin/etp-csv"
+        assert Path(paths.df).is_absolute()
 
 
 def _fake_run_cmd(responses):
-    """Return a mock for run_cmd that returns responses in order."""
+    """Return a mock for run_cmd that emits responses in order.
+
+    Each response is returned when capturing, or written to the stdout file
+    when one is passed, mirroring how the real child process would behave.
+    """
     calls = []
     it = iter(responses)
 
-    def mock(args, *, capture=False, verbose=False, env_extra=None):
+    def mock(args, *, capture=False, stdout=None, verbose=False, env_extra=None):
         calls.append(list(args))
-        return next(it) if capture else None
+        if capture:
+            return next(it).encode("utf-8")
+        if stdout is not None:
+            stdout.write(next(it).encode("utf-8"))
+        return None
 
     return mock, calls
 
 
 class TestGenerateTree:
     def test_mode_used(self, tmp_path):
-        global_cfg = _make_global_cfg(tmp_path)
+        paths = _make_paths(tmp_path)
         scan_cfg = _make_scan_cfg("used")
         # etp-tree with --du returns tree output
         mock, calls = _fake_run_cmd(["tree output\nSize: 42.00 MiB (root)\n"])
 
-        with (
-            patch.object(catalog, "run_cmd", mock),
-            patch.object(catalog, "require_binary", return_value="/usr/bin/etp-tree"),
-        ):
-            catalog.generate_tree("mytest", scan_cfg, global_cfg)
+        with patch.object(catalog, "run_cmd", mock):
+            catalog.generate_tree("mytest", scan_cfg, paths)
 
         tree_file = tmp_path / "trees" / "test-scan.tree"
         content = tree_file.read_text()
@@ -298,16 +420,13 @@ class TestGenerateTree:
         assert "--du-subs" not in calls[0]
 
     def test_mode_df(self, tmp_path):
-        global_cfg = _make_global_cfg(tmp_path)
+        paths = _make_paths(tmp_path)
         scan_cfg = _make_scan_cfg("df")
         # etp-tree output, then df -PH output
         mock, calls = _fake_run_cmd(["tree output\n", "Filesystem Size Used\n"])
 
-        with (
-            patch.object(catalog, "run_cmd", mock),
-            patch.object(catalog, "require_binary", return_value="/usr/bin/etp-tree"),
-        ):
-            catalog.generate_tree("mytest", scan_cfg, global_cfg)
+        with patch.object(catalog, "run_cmd", mock):
+            catalog.generate_tree("mytest", scan_cfg, paths)
 
         tree_file = tmp_path / "trees" / "test-scan.tree"
         content = tree_file.read_text()
@@ -317,10 +436,10 @@ class TestGenerateTree:
         # etp-tree (no --du for df mode) + df -PH
         assert len(calls) == 2
         assert "--du" not in calls[0]
-        assert calls[1] == ["df", "-PH", "/vol/data"]
+        assert calls[1] == ["/bin/df", "-PH", "/vol/data"]
 
     def test_mode_subs(self, tmp_path):
-        global_cfg = _make_global_cfg(tmp_path)
+        paths = _make_paths(tmp_path)
         scan_cfg = _make_scan_cfg("subs")
         # etp-tree with --du --du-subs, then df -PH
         mock, calls = _fake_run_cmd(
@@ -330,11 +449,8 @@ class TestGenerateTree:
             ]
         )
 
-        with (
-            patch.object(catalog, "run_cmd", mock),
-            patch.object(catalog, "require_binary", return_value="/usr/bin/etp-tree"),
-        ):
-            catalog.generate_tree("mytest", scan_cfg, global_cfg)
+        with patch.object(catalog, "run_cmd", mock):
+            catalog.generate_tree("mytest", scan_cfg, paths)
 
         tree_file = tmp_path / "trees" / "test-scan.tree"
         content = tree_file.read_text()
@@ -345,4 +461,253 @@ class TestGenerateTree:
         assert len(calls) == 2
         assert "--du" in calls[0]
         assert "--du-subs" in calls[0]
-        assert calls[1] == ["df", "-PH", "/vol/data"]
+        assert calls[1] == ["/bin/df", "-PH", "/vol/data"]
+
+    def test_unknown_mode_raises(self, tmp_path):
+        paths = _make_paths(tmp_path)
+        scan_cfg = _make_scan_cfg("bogus")
+        mock, calls = _fake_run_cmd([])
+
+        with (
+            patch.object(catalog, "run_cmd", mock),
+            pytest.raises(ValueError, match="unknown mode 'bogus'"),
+        ):
+            catalog.generate_tree("mytest", scan_cfg, paths)
+        assert calls == []
+
+    def test_parts_written_in_order(self, tmp_path):
+        paths = _make_paths(tmp_path)
+        scan_cfg = _make_scan_cfg("df")
+        mock, _calls = _fake_run_cmd(["tree output\n", "Filesystem Size Used\n"])
+
+        with patch.object(catalog, "run_cmd", mock):
+            catalog.generate_tree("mytest", scan_cfg, paths)
+
+        tree_file = tmp_path / "trees" / "test-scan.tree"
+        assert tree_file.read_text() == (
+            "Test Header\n\ntree output\n\nFilesystem Size Used\n"
+        )
+
+    def test_failure_keeps_previous_tree(self, tmp_path):
+        paths = _make_paths(tmp_path)
+        scan_cfg = _make_scan_cfg("df")
+        tree_file = tmp_path / "trees" / "test-scan.tree"
+        tree_file.write_text("previous tree\n")
+
+        def failing(args, **_kwargs):
+            raise subprocess.CalledProcessError(1, args)
+
+        with (
+            patch.object(catalog, "run_cmd", failing),
+            pytest.raises(subprocess.CalledProcessError),
+        ):
+            catalog.generate_tree("mytest", scan_cfg, paths)
+
+        assert tree_file.read_text() == "previous tree\n"
+        assert list((tmp_path / "trees").iterdir()) == [tree_file]
+
+
+class TestRunCmd:
+    def test_streams_stdout_to_file(self, tmp_path):
+        out = tmp_path / "out.txt"
+        with open(out, "wb", buffering=0) as f:
+            f.write(b"before\n")
+            result = catalog.run_cmd(["echo", "hello"], stdout=f)
+            f.write(b"after\n")
+        assert result is None
+        assert out.read_text() == "before\nhello\nafter\n"
+
+    def test_python_fds_not_inherited(self, tmp_path):
+        with open(tmp_path / "private.txt", "wb") as f:
+            fd = f.fileno()
+            with pytest.raises(subprocess.CalledProcessError):
+                catalog.run_cmd(["sh", "-c", f"echo leak >&{fd}"], capture=True)
+
+    def test_capture_returns_stdout(self):
+        assert catalog.run_cmd(["echo", "hello"], capture=True) == b"hello\n"
+
+    def test_env_extra_reaches_child(self, monkeypatch):
+        monkeypatch.setenv("CATALOG_BASE_VAR", "base")
+        out = catalog.run_cmd(
+            ["sh", "-c", 'echo "$CATALOG_BASE_VAR $CATALOG_EXTRA_VAR"'],
+            capture=True,
+            env_extra={"CATALOG_EXTRA_VAR": "extra"},
+        )
+        assert out == b"base extra\n"
+
+    def test_verbose_banner_quotes_args(self, capsys):
+        catalog.run_cmd(["echo", "two words"], capture=True, verbose=True)
+        assert capsys.readouterr().out == "  $ echo 'two words'\n"
+
+
+class TestDeviceLanes:
+    def test_same_device_shares_lane(self, tmp_path):
+        (tmp_path / "a").mkdir()
+        (tmp_path / "b").mkdir()
+        scans = {
+            "a": _make_scan_cfg("used", disk=str(tmp_path / "a")),
+            "b": _make_scan_cfg("used", disk=str(tmp_path / "b")),
+        }
+        lanes = catalog.device_lanes(scans)
+        assert [[name for name, _ in lane] for lane in lanes] == [["a", "b"]]
+
+    def test_missing_disk_gets_own_lane(self, tmp_path):
+        scans = {
+            "real": _make_scan_cfg("used", disk=str(tmp_path)),
+            "gone1": _make_scan_cfg("used", disk=str(tmp_path / "nope1")),
+            "gone2": _make_scan_cfg("used", disk=str(tmp_path / "nope2")),
+        }
+        lanes = catalog.device_lanes(scans)
+        assert [[name for name, _ in lane] for lane in lanes] == [
+            ["real"],
+            ["gone1"],
+            ["gone2"],
+        ]
+
+
+class TestCLIJobs:
+    def _write_config(self, tmp_path):
+        config = tmp_path / "test.kdl"
+        config.write_text(
+            textwrap.dedent(f"""\
+            global {{
+                trees-path "{tmp_path}/trees"
+                csvs-path "{tmp_path}/csvs"
+                db-path "{tmp_path}/db"
+            }}
+
+            scan "one" {{
+                mode "used"
+                disk "{tmp_path}/one"
+                desc "one"
+                header "one"
+            }}
+
+            scan "two" {{
+                mode "used"
+                disk "{tmp_path}/two"
+                desc "two"
+                header "two"
+            }}
+        """)
+        )
+        return config
+
+    def test_parallel_failures_reported_in_config_order(self, tmp_path, capsys):
+        config = self._write_config(tmp_path)
+        ran = []
+
+        def fake_run_scan(name, scan_cfg, paths, **_kwargs):
+            ran.append(name)
+            return False
+
+        with (
+            patch.object(catalog, "run_scan", fake_run_scan),
+            patch.object(catalog, "require_binary", side_effect=lambda n: n),
+        ):
+            rc = catalog.main(["--jobs", "4", str(config)])
+
+        assert rc == 1
+        assert sorted(ran) == ["one", "two"]
+        assert "2 scan(s) failed: one, two" in capsys.readouterr().out
+
+    def _run_capturing_workers(self, argv):
+        workers = []
+        real_pool = catalog.concurrent.futures.ThreadPoolExecutor
+
+        def pool(max_workers):
+            workers.append(max_workers)
+            return real_pool(max_workers=max_workers)
+
+        with (
+            patch.object(catalog, "run_scan", return_value=True),
+            patch.object(catalog, "require_binary", side_effect=lambda n: n),
+            patch.object(catalog.concurrent.futures, "ThreadPoolExecutor", pool),
+        ):
+            rc = catalog.main(argv)
+        assert rc == 0
+        return workers
+
+    def test_jobs_must_not_be_negative(self, tmp_path, capsys):
+        config = self._write_config(tmp_path)
+        with pytest.raises(SystemExit):
+            catalog.main(["--jobs", "-1", str(config)])
+        assert "must be 0 or more" in capsys.readouterr().err
+
+    def test_jobs_from_env(self, tmp_path, monkeypatch):
+        config = self._write_config(tmp_path)
+        monkeypatch.setenv("ETP_CATALOG_JOBS", "2")
+        assert self._run_capturing_workers([str(config)]) == [2]
+
+    def test_jobs_flag_overrides_env(self, tmp_path, monkeypatch):
+        config = self._write_config(tmp_path)
+        monkeypatch.setenv("ETP_CATALOG_JOBS", "2")
+        # A single worker runs inline, without a pool
+        assert self._run_capturing_workers(["-j", "1", str(config)]) == []
+
+    def test_invalid_env_jobs_errors(self, tmp_path, monkeypatch, capsys):
+        config = self._write_config(tmp_path)
+        monkeypatch.setenv("ETP_CATALOG_JOBS", "many")
+        with pytest.raises(SystemExit):
+            catalog.main([str(config)])
+        assert "ETP_CATALOG_JOBS" in capsys.readouterr().err
+
+    def test_zero_jobs_uses_available_cpus(self, tmp_path, monkeypatch):
+        config = self._write_config(tmp_path)
+        monkeypatch.setattr(catalog, "_worker_count", lambda: 8)
+        # Two lanes, so the pool is capped at two workers
+        assert self._run_capturing_workers(["-j", "0", str(config)]) == [2]
+
+    def test_sequential_run_stops_on_interrupt(self, tmp_path):
+        config = self._write_config(tmp_path)
+        ran = []
+
+        def fake_run_scan(name, scan_cfg, paths, **_kwargs):
+            ran.append((name, threading.current_thread() is threading.main_thread()))
+            raise KeyboardInterrupt
+
+        with (
+            patch.object(catalog, "run_scan", fake_run_scan),
+            patch.object(catalog, "require_binary", side_effect=lambda n: n),
+            pytest.raises(KeyboardInterrupt),
+        ):
+            catalog.main([str(config)])
+
+        assert ran == [("one", True)]
+
+    def test_parallel_run_starts_no_new_scans_on_interrupt(self, tmp_path, monkeypatch):
+        config = self._write_config(tmp_path)
+        monkeypatch.setattr(
+            catalog,
+            "device_lanes",
+            lambda scans: [
+                [("a1", {}), ("a2", {})],
+                [("b1", {}), ("b2", {})],
+            ],
+        )
+        ran = []
+        b1_started = threading.Event()
+
+        def fake_run_scan(name, scan_cfg, paths, **_kwargs):
+            ran.append(name)
+            if name == "a1":
+                b1_started.wait(timeout=5)
+                raise KeyboardInterrupt
+            if name == "b1":
+                b1_started.set()
+                time.sleep(0.2)
+            return True
+
+        with (
+            patch.object(catalog, "run_scan", fake_run_scan),
+            patch.object(catalog, "require_binary", side_effect=lambda n: n),
+        ):
+            with pytest.raises(KeyboardInterrupt):
+                catalog.main(["-j", "2", str(config)])
+
+            # Let the in-flight scan finish, then check nothing followed it
+            for thread in threading.enumerate():
+                if thread.name.startswith("ThreadPoolExecutor"):
+                    thread.join(timeout=5)
+
+        assert sorted(ran) == ["a1", "b1"]